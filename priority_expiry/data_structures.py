@@ -1,11 +1,12 @@
 """data_structures module containing the quadtree used by the
 Priority Expiry Cache."""
 
-import enum
-from bisect import bisect_left
-from collections import deque
+import heapq
+import itertools
+import math
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Hashable, Optional, Dict, Union, List, TypeVar, Generic
+from typing import Hashable, Optional, Union, Iterable, List, TypeVar, Generic
 
 Priority = int
 Time = int
@@ -14,26 +15,16 @@ KT = TypeVar("KT", bound=Hashable)
 VT = TypeVar("VT")
 
 
-class QuadrantIndex(enum.Enum):
-    """Indexes for referencing the four quadrants of each node of the Quadtree.
-
-    Attributes:
-        ONE: older or equal expiry, higher priority
-        TWO: older or equal expiry, lower or equal priority
-        THREE: newer expiry, higher priority
-        FOUR: newer expiry, lower or equal priority
-    """
-
-    ONE = True, True
-    TWO = True, False
-    THREE = False, True
-    FOUR = False, False
+# Indexes for referencing the four quadrants of each node of the Quadtree.
+# The index of a point relative to a node is given by
+# `((expiry <= node.expiry) << 1) | (priority < node.priority)`.
+QUADRANT_ONE = 3  # older or equal expiry, higher priority
+QUADRANT_TWO = 2  # older or equal expiry, lower or equal priority
+QUADRANT_THREE = 1  # newer expiry, higher priority
+QUADRANT_FOUR = 0  # newer expiry, lower or equal priority
 
-
-OLDER_QUADS = {QuadrantIndex.ONE, QuadrantIndex.TWO}
-YOUNGER_QUADS = {QuadrantIndex.THREE, QuadrantIndex.FOUR}
-BEST_QUADS = {QuadrantIndex.ONE, QuadrantIndex.THREE}
-WORST_QUADS = {QuadrantIndex.TWO, QuadrantIndex.FOUR}
+BEST_QUADS = (QUADRANT_ONE, QUADRANT_THREE)
+WORST_QUADS = (QUADRANT_TWO, QUADRANT_FOUR)
 
 
 class EmptyNode(ValueError):
@@ -44,21 +35,20 @@ class EmptyTree(ValueError):
     """Raised when there are no nodes in a quad tree with data"""
 
 
-@dataclass(order=True, eq=True)
-class Entry(Generic[KT, VT]):
+@dataclass(slots=True, eq=False)
+class Entry(Generic[VT]):
     """Item for storing cache entries in Nodes.
 
-    These support ordering by last_used. This is useful for keeping track of
-    and quickly determining the least recently used entry in the event of
-    priority ties.
+    The last_used time is useful for quickly determining the least recently
+    used entry in the event of priority ties. The key of the entry is not
+    stored as nodes already index their entries by key.
     """
 
-    last_used: Time = field(compare=True)
-    key: KT = field(compare=False)
-    value: VT = field(compare=False)
+    last_used: Time
+    value: VT
 
 
-@dataclass
+@dataclass(slots=True)
 class Quadtree(Generic[KT, VT]):
     """The top-level object to be used for performing operations on the
     Quadtree.
@@ -111,40 +101,19 @@ class Quadtree(Generic[KT, VT]):
         """This a no-op. It is here for compatability with the node interface."""
         return
 
-    def prune_expired(self, now: Time) -> bool:
-        """Remove expired nodes.
-
-        Note that some expired nodes cannot be easily removed from the tree as
-        they continue to support the division of exactly two quadrants. In this
-        case the entries those nodes contain are deleted, and are left in
-        place. These nodes will be able to eventually be removed in future
-        invocations as other nodes around them become expired.
-
-        It may be possible to restructure the tree to allow the removal of
-        these nodes, however this significantly increase the algorithms
-        complexity (in terms of statements and branches) and will possibly
-        increase the time complexity beyond `log(e)+log(p)`.
-
-        Args:
-            now: the current time.
-
-        Returns:
-            bool: True indicates that at least one entry was removed from the
-                cache as a result of pruning expired nodes.
-        """
-
-        if self._root is None:
-            return False
-        return self._root.prune_expired(now)
-
     def prune_lowest_priority(self) -> KT:
         """Remove the entry from the tree with the lowest priority.
 
-        This is done with a breadth first search to find the node with the
+        This is done with a best first search to find the node with the
         lowest priority with the least recently used entry. Paths that
         cannot lead to lower priority node than the currently lowest found
         are avoided.
 
+        Each subtree is queued with a bound on the priority values it can
+        contain, implied by the quadrants it was reached through. Subtrees
+        with the weakest bound are searched first, and the search stops as
+        soon as no queued subtree can beat the currently lowest node.
+
         The least recently used entry is removed from the found node.
 
         Raises:
@@ -157,31 +126,54 @@ class Quadtree(Generic[KT, VT]):
         if self._root is None:
             raise EmptyTree
 
-        lowest: Node = self._root
-        if lowest.empty:
-            stack = list(lowest.quadrants.values())
-        else:
-            stack = lowest.lower_priority_nodes
-        while stack:
-            node: Node = stack.pop()
-            if node.empty:
-                stack.extend(node.quadrants.values())
+        # the search loop binds its helpers and the priority and last used
+        #  time of the lowest node to locals, and reads node entries directly
+        #  rather than through the empty property, to avoid repeating
+        #  attribute and property lookups for every visited node.
+        heappush, heappop = heapq.heappush, heapq.heappop
+        next_count = itertools.count().__next__
+        lowest: Optional[Node] = None
+        lowest_priority = -math.inf
+        lowest_lru_time = math.inf
+        # entries are (negated exclusive upper bound of the priority values
+        #  in the subtree, tie breaker, subtree root)
+        heap = [(-math.inf, next_count(), self._root)]
+        while heap:
+            negated_bound, _, node = heappop(heap)
+            bound = -negated_bound
+            if bound <= lowest_priority:
+                break
+            priority = node.priority
+            lru_entries = node._lru_entries
+            if not lru_entries:
+                for index, child in enumerate(node.quadrants):
+                    if child is None:
+                        continue
+                    if index in BEST_QUADS and priority < bound:
+                        heappush(heap, (-priority, next_count(), child))
+                    else:
+                        heappush(heap, (negated_bound, next_count(), child))
                 continue
-            if lowest.empty:
-                lowest = node
-            elif node.priority > lowest.priority or (
-                node.priority == lowest.priority and node.lru_time < lowest.lru_time
+            lru_time = next(iter(lru_entries.values())).last_used
+            if priority > lowest_priority or (
+                priority == lowest_priority and lru_time < lowest_lru_time
             ):
                 lowest = node
-            stack.extend(node.lower_priority_nodes)
-
-        if lowest.empty:
+                lowest_priority = priority
+                lowest_lru_time = lru_time
+            quadrants = node.quadrants
+            for index in WORST_QUADS:
+                child = quadrants[index]
+                if child is not None:
+                    heappush(heap, (negated_bound, next_count(), child))
+
+        if lowest is None:
             raise EmptyTree
 
         return lowest.pop_lru()
 
 
-@dataclass
+@dataclass(slots=True)
 class Node(Generic[KT, VT]):
     """Node of a Quadtree.
 
@@ -193,20 +185,23 @@ class Node(Generic[KT, VT]):
             higher priority.
         parent: The parent node of this node. This may return to the Quadtree
             object if this is the root node.
-        quadrants: The child nodes. If a child node does not exist for a
-            quadrant then it won't exist at all in this mapping.
+        quadrants: The child nodes, indexed by quadrant. If a child node does
+            not exist for a quadrant then its slot is None.
+        removed: Indicates that this node has been removed from the Quadtree
+            and should no longer be used.
     """
 
     expiry: Time
     priority: Priority
     parent: Union["Node[KT, VT]", Quadtree[KT, VT]]
-    quadrants: Dict[QuadrantIndex, "Node[KT, VT]"] = field(
-        default_factory=dict, init=False, repr=False
+    quadrants: List[Optional["Node[KT, VT]"]] = field(
+        default_factory=lambda: [None, None, None, None], init=False, repr=False
     )
 
-    _data: Dict[KT, Entry[KT, VT]] = field(default_factory=dict, init=False, repr=False)
-    _lru_queue: deque[Entry[KT, VT]] = field(
-        default_factory=deque, init=False, repr=False
+    removed: bool = field(default=False, init=False, repr=False)
+
+    _lru_entries: OrderedDict[KT, Entry[VT]] = field(
+        default_factory=OrderedDict, init=False, repr=False
     )
 
     def add_entry(self, key: KT, value: VT, now: Time) -> None:
@@ -219,9 +214,7 @@ class Node(Generic[KT, VT]):
                 used.
         """
 
-        entry = Entry(now, key, value)
-        self._data[key] = entry
-        self._lru_queue.append(entry)
+        self._lru_entries[key] = Entry(now, value)
 
     def delete_entry(self, key: KT, clean: bool = True) -> None:
         """Deletes an entry
@@ -234,18 +227,7 @@ class Node(Generic[KT, VT]):
             clean: Whether to clean the node after the entry has been deleted.
         """
 
-        entry = self._data.pop(key)
-        idx = bisect_left(self._lru_queue, entry)
-        while (
-            idx < len(self._lru_queue)
-            and self._lru_queue[idx].last_used == entry.last_used
-        ):
-            if self._lru_queue[idx] is entry:
-                del self._lru_queue[idx]
-                break
-            idx += 1
-        else:
-            raise Exception("entry unexpectedly missing for lru queue")
+        del self._lru_entries[key]
         if clean:
             self.clean(recurse=True)
 
@@ -259,10 +241,9 @@ class Node(Generic[KT, VT]):
         if self.empty:
             raise EmptyNode
 
-        least_recent = self._lru_queue.popleft()
-        del self._data[least_recent.key]
+        key, _ = self._lru_entries.popitem(last=False)
         self.clean(recurse=True)
-        return least_recent.key
+        return key
 
     def access_entry(self, key: KT, now: Time) -> VT:
         """Gets the value of an entry for a given key
@@ -279,62 +260,51 @@ class Node(Generic[KT, VT]):
             VT: The value associated with the key.
         """
 
-        value = self._data[key].value
-        self.delete_entry(key, clean=False)
-        self.add_entry(key, value, now)
-        return value
+        entry = self._lru_entries[key]
+        entry.last_used = now
+        self._lru_entries.move_to_end(key)
+        return entry.value
 
-    def clear_entries(self) -> None:
-        """Remove all entries from this node.
+    def update_entry(self, key: KT, value: VT, now: Time) -> None:
+        """Replaces the value of an existing entry and marks it as the most
+        recently used.
 
-        This may be invoked when the node has expired.
+        Raises:
+            KeyError: the entry does not exist in this node.
+
+        Args:
+            key: The key of the entry to be updated.
+            value: The new value of the entry.
+            now: The current time. Used to update the last_used timestamp of
+                the entry for determining LRU.
         """
 
-        self._data.clear()
-        self._lru_queue.clear()
+        entry = self._lru_entries[key]
+        entry.value = value
+        entry.last_used = now
+        self._lru_entries.move_to_end(key)
 
-    @property
-    def lru_time(self) -> Time:
-        """The last used time of the oldest entry in this Node.
+    def clear_entries(self) -> Iterable[KT]:
+        """Remove all entries from this node.
 
-        Raises:
-            EmptyNode: the node has no entries and therefore this node isn't
-                relevant to LRU.
+        This may be invoked when the node has expired.
 
         Returns:
-            Time: The last used time of the oldest entry in this Node
+            Iterable[KT]: The keys of the removed entries. The entries are
+                swapped out rather than copied, so this is O(1).
         """
-        if self.empty:
-            raise EmptyNode
-        return self._lru_queue[0].last_used
+
+        entries, self._lru_entries = self._lru_entries, OrderedDict()
+        return entries.keys()
 
     @property
     def empty(self) -> bool:
         """Indicates whether this node has any entries."""
-        return not bool(self._lru_queue)
-
-    @property
-    def deep_empty(self) -> bool:
-        """Indicates whether this node or any of its descendents have any
-        entries."""
-        return self.empty and all(node.deep_empty for node in self.quadrants.values())
-
-    def expired(self, now: Time) -> bool:
-        """Indicates whether this node has expired given a time.
-
-        Args:
-            now: The current time.
-
-        Returns:
-            bool: True if this node has expired.
-        """
-        return self.expiry < now
+        return not bool(self._lru_entries)
 
-    def quadrant_index(self, node: "Node[KT, VT]") -> QuadrantIndex:
+    def quadrant_index(self, node: "Node[KT, VT]") -> int:
         """The quadrant that a node would be placed in on this node."""
-        return QuadrantIndex(
-            (node.expiry <= self.expiry, node.priority < self.priority)
-        )
+        return ((node.expiry <= self.expiry) << 1) | (node.priority < self.priority)
 
     def insert(self, priority: Priority, expiry: Time) -> "Node[KT, VT]":
         """Inserts a new node.
@@ -344,7 +314,7 @@ class Node(Generic[KT, VT]):
         to this node.
 
         Otherwise, the priority-expiry point is given to the node currently
-        in the matching quadrant to be inserted. This recursion continues until
+        in the matching quadrant to be inserted. This descent continues until
         a place for the point is found.
 
         Args:
@@ -354,12 +324,14 @@ class Node(Generic[KT, VT]):
             Node: the node that was created.
         """
 
-        index = QuadrantIndex((expiry <= self.expiry, priority < self.priority))
-        try:
-            return self.quadrants[index].insert(priority, expiry)
-        except KeyError:
-            self.quadrants[index] = Node(expiry, priority, self)
-            return self.quadrants[index]
+        node = self
+        while True:
+            index = ((expiry <= node.expiry) << 1) | (priority < node.priority)
+            child = node.quadrants[index]
+            if child is None:
+                child = node.quadrants[index] = Node(expiry, priority, node)
+                return child
+            node = child
 
     def replace(self, node: "Node[KT, VT]"):
         """Inserts a node into this node's direct quadrant references.
@@ -374,7 +346,7 @@ class Node(Generic[KT, VT]):
     def delete(self, node: "Node[KT, VT]"):
         """Deletes a node from this node's quadrant references."""
 
-        del self.quadrants[self.quadrant_index(node)]
+        self.quadrants[self.quadrant_index(node)] = None
 
     def clean(self, recurse=False) -> None:
         """Attempts to remove this node from the Quadtree if it has no
@@ -387,49 +359,21 @@ class Node(Generic[KT, VT]):
         """
 
         if self.empty:
-            if not self.quadrants:
+            children = self.children
+            if not children:
                 parent = self.parent
                 self.parent.delete(self)
+                self.removed = True
                 if recurse:
                     parent.clean(recurse=True)
 
-            if len(self.quadrants) == 1:
-                self.parent.replace(self.quadrants.popitem()[1])
-
-    def prune_expired(self, now: Time) -> bool:
-        """Prunes expired sections of the tree.
-
-        See Quadtree.prune_expired for more information.
-
-        Args:
-            now: The time used to determine whether nodes have expired.
-
-        Returns:
-            bool: True if at least one node with data has expired.
-                False otherwise.
-        """
-        result = False
-        if self.expired(now):
-            result |= not self.empty
-            for index in OLDER_QUADS & set(self.quadrants):
-                result |= not self.quadrants[index].deep_empty
-                del self.quadrants[index]
-
-            for quad in list(self.quadrants.values()):
-                result |= quad.prune_expired(now)
-
-            self.clear_entries()
-
-        for index in OLDER_QUADS & set(self.quadrants):
-            result |= self.quadrants[index].prune_expired(now)
-
-        self.clean()
-
-        return result
+            if len(children) == 1:
+                self.quadrants = [None, None, None, None]
+                self.parent.replace(children[0])
+                self.removed = True
 
     @property
-    def lower_priority_nodes(self) -> List["Node[KT, VT]"]:
-        """Nodes from this node's quadrant references that have a lower
-        priority."""
+    def children(self) -> List["Node[KT, VT]"]:
+        """The existing child nodes of this node."""
 
-        return [self.quadrants[index] for index in set(self.quadrants) & WORST_QUADS]
+        return [node for node in self.quadrants if node is not None]
@@ -1,6 +1,7 @@
 """Mappings module containing the Priority Expiry Cache."""
 
 import contextlib
+import heapq
 import time
 from typing import (
     TypeVar,
@@ -8,10 +9,12 @@ from typing import (
     MutableMapping,
     Callable,
     Tuple,
+    Iterable,
     Iterator,
+    List,
     Optional,
+    Dict,
 )
-from weakref import WeakValueDictionary
 
 from priority_expiry.data_structures import (
     Priority,
@@ -33,6 +36,37 @@ class KeyExpired(KeyError):
     """Raised when key exists in cache, but it has expired."""
 
 
+class _Context(contextlib.ContextDecorator):
+    """Context manager returned by `Cache.context`.
+
+    On entry the cache's current priority and expiry duration are replaced
+    with those of this context, and on exit the previous ones are restored.
+    Unset values are resolved against the cache's defaults on entry.
+
+    As a `ContextDecorator` it may also decorate functions, so it may be
+    entered again while it is already active.
+    """
+
+    def __init__(
+        self,
+        cache: "Cache",
+        priority: Optional[Priority],
+        expiry_duration: Optional[Time],
+    ):
+        self._cache = cache
+        self._priority = priority
+        self._expiry_duration = expiry_duration
+        self._previous: List[Optional[Tuple[Priority, Time]]] = []
+
+    def __enter__(self) -> None:
+        settings = self._cache._resolve_settings(self._priority, self._expiry_duration)
+        self._previous.append(self._cache._context)
+        self._cache._context = settings
+
+    def __exit__(self, *exc_info) -> None:
+        self._cache._context = self._previous.pop()
+
+
 class Cache(MutableMapping[KT, VT]):
     """Priority Expiry Cache.
 
@@ -57,9 +91,16 @@ class Cache(MutableMapping[KT, VT]):
      * Accessing the value of an entry.
      * Updating the value of an entry.
      * Deleting an entry.
-    These maps use weakrefs to the nodes. This means that the maps will be
-    automatically cleaned when expired and empty nodes are removed from the
-    quadtree.
+    Keys are removed from the key map as their entries are deleted or
+    evicted.
+
+    A min-heap of node expiries and priorities is also kept alongside the
+    quadtree. This allows expired entries to be evicted in time proportional
+    to the number of expired nodes, rather than by walking the quadtree.
+    Nodes are removed from the point map as they are popped from this heap,
+    or earlier if they are removed from the quadtree because they became
+    empty. The heap is rebuilt from the point map once it has accumulated
+    many points of such nodes.
 
     Attributes:
         clock: Callable that should return the current time. It recommended
@@ -82,18 +123,21 @@ class Cache(MutableMapping[KT, VT]):
         default_expiry_duration: int = int(1e9),
         default_priority: Priority = 0,
     ):
+        if default_expiry_duration <= 0:
+            raise ValueError("default_expiry_duration must be positive")
+
         self.clock = clock
         self.default_expiry_duration = default_expiry_duration
         self.default_priority = default_priority
 
         self._tree: Quadtree[KT, VT] = Quadtree()
-        self._expiry_priority_nodes: WeakValueDictionary[
-            Tuple[Time, Priority], Node
-        ] = WeakValueDictionary()
-        self._key_nodes: WeakValueDictionary[KT, Node] = WeakValueDictionary()
+        self._expiry_priority_nodes: Dict[Tuple[Time, Priority], Node] = {}
+        self._key_nodes: Dict[KT, Node] = {}
+        self._expiry_heap: List[Tuple[Time, Priority]] = []
 
-        self._context_expiry_duration = self.default_expiry_duration
-        self._context_priority = self.default_priority
+        # the priority and expiry duration given to entries that are set
+        #  within a context. If `None`, then the defaults are used.
+        self._context: Optional[Tuple[Priority, Time]] = None
 
     def evict(self) -> None:
         """Evict entries form the cache.
@@ -108,10 +152,26 @@ class Cache(MutableMapping[KT, VT]):
         If multiple entries with the lowest priority were used at the same
         time, then only one of those entries will be removed - the choice as to
         which is undefined.
+
+        Note that some expired nodes cannot be removed from the quadtree as
+        they continue to support the division of exactly two quadrants. In
+        this case the entries those nodes contain are deleted, and the nodes
+        are left in place. These nodes will eventually be removed as the nodes
+        around them are removed.
         """
 
         now = self.clock()
-        any_removed = self._tree.prune_expired(now)
+        any_removed = False
+        expiry_heap = self._expiry_heap
+        while expiry_heap and expiry_heap[0][0] < now:
+            node = self._expiry_priority_nodes.pop(heapq.heappop(expiry_heap), None)
+            if node is None or not node._lru_entries:
+                continue
+            for key in node.clear_entries():
+                del self._key_nodes[key]
+            node.clean(recurse=True)
+            self._forget_removed(node)
+            any_removed = True
         if any_removed:
             return
 
@@ -119,19 +179,13 @@ class Cache(MutableMapping[KT, VT]):
             key = self._tree.prune_lowest_priority()
         except EmptyTree:
             return
-        try:
-            del self._key_nodes[key]
-        except KeyError:
-            # the key may have already been removed by the weakref callback
-            #  if it was the only item in the node.
-            return
+        self._forget_removed(self._key_nodes.pop(key))
 
-    @contextlib.contextmanager
     def context(
         self,
         priority: Optional[Priority] = None,
         expiry_duration: Optional[Time] = None,
-    ):
+    ) -> _Context:
         """Context manager for controlling the priority and expiry of entries
         added to the cache.
 
@@ -140,6 +194,19 @@ class Cache(MutableMapping[KT, VT]):
         ...     cache["test_key"] = "test_value"
         ...
 
+        Contexts may be nested, in which case the outer context applies again
+        once the inner context exits. A context may also be used as a function
+        decorator.
+
+        >>> @cache.context(priority=10)
+        ... def set_low_priority(key, value):
+        ...     cache[key] = value
+        ...
+
+        Raises:
+            ValueError: expiry_duration is not positive. This is raised when
+                the context is entered.
+
         Args:
             priority: Priority that will be given to entries set within the
                 context. If `None`, then the default priority will be used.
@@ -147,25 +214,140 @@ class Cache(MutableMapping[KT, VT]):
                 the context. If `None`, then the default priority will be used.
         """
 
-        if priority is not None:
-            self._context_priority = priority
-        else:
-            self._context_priority = self.default_priority
-        if expiry_duration is not None:
-            self._context_expiry_duration = expiry_duration
-        else:
-            self._context_expiry_duration = self.default_expiry_duration
-        try:
-            yield
-        finally:
-            self._context_priority = self.default_priority
-            self._context_expiry_duration = self.default_expiry_duration
+        return _Context(self, priority, expiry_duration)
+
+    def put(
+        self,
+        key: KT,
+        value: VT,
+        priority: Optional[Priority] = None,
+        expiry_duration: Optional[Time] = None,
+    ) -> None:
+        """Set the value of a keyed entry with the given priority and expiry
+        duration, regardless of the current context.
+
+        >>> cache = Cache()
+        >>> cache.put("test_key", "test_value", priority=10, expiry_duration=1)
+
+        See `__setitem__` for more information.
+
+        Raises:
+            ValueError: expiry_duration is not positive.
+
+        Args:
+            key: The key of the entry
+            value: The value of the entry
+            priority: Priority that will be given to the entry. If `None`, then
+                the default priority will be used.
+            expiry_duration: Duration that will be given to the entry. If
+                `None`, then the default expiry duration will be used.
+        """
+
+        priority, expiry_duration = self._resolve_settings(priority, expiry_duration)
+        now = self.clock()
+        self._set_at(now, key, value, priority, now + expiry_duration)
+
+    def bulk_set(
+        self,
+        items: Iterable[Tuple[KT, VT]],
+        priority: Optional[Priority] = None,
+        expiry_duration: Optional[Time] = None,
+    ) -> None:
+        """Set the values of many keyed entries with a single read of the clock.
+
+        This behaves as setting each entry in turn within
+        `context(priority, expiry_duration)`, except that every entry is given
+        the same last used time and expiry.
+
+        >>> cache = Cache()
+        >>> cache.bulk_set([("first_key", 0), ("second_key", 1)], priority=10)
+        >>> assert cache["second_key"] == 1
+
+        Raises:
+            ValueError: expiry_duration is not positive.
+
+        Args:
+            items: Key-value pairs of the entries.
+            priority: Priority that will be given to the entries. If `None`,
+                then the default priority will be used.
+            expiry_duration: Duration that will be given to the entries. If
+                `None`, then the default expiry duration will be used.
+        """
+
+        priority, expiry_duration = self._resolve_settings(priority, expiry_duration)
+        now = self.clock()
+        expiry = now + expiry_duration
+        set_at = self._set_at
+        for key, value in items:
+            set_at(now, key, value, priority, expiry)
+
+    def bulk_put(
+        self,
+        entries: Iterable[Tuple[KT, VT, Optional[Priority], Optional[Time]]],
+    ) -> None:
+        """Set the values of many keyed entries, each with its own priority
+        and expiry duration, with a single read of the clock.
+
+        This behaves as calling `put` for each entry in turn, except that every
+        entry is given the same last used time. The priorities and expiry
+        durations of all entries are validated before any entry is set.
+
+        >>> cache = Cache()
+        >>> cache.bulk_put([("first_key", 0, 10, None), ("second_key", 1, 5, 1)])
+        >>> assert cache["first_key"] == 0
+
+        Raises:
+            ValueError: an expiry_duration is not positive.
+
+        Args:
+            entries: Tuples of the key, value, priority and expiry duration of
+                each entry. If a priority or expiry duration is `None`, then
+                the default will be used.
+        """
+
+        resolve_settings = self._resolve_settings
+        resolved = [
+            (key, value, *resolve_settings(priority, expiry_duration))
+            for key, value, priority, expiry_duration in entries
+        ]
+        now = self.clock()
+        set_at = self._set_at
+        for key, value, priority, expiry_duration in resolved:
+            set_at(now, key, value, priority, now + expiry_duration)
+
+    def clear(self) -> None:
+        """Removes all entries from the cache, including expired entries.
+
+        This replaces the internal structures rather than deleting entries
+        one at a time. The current context is kept.
+
+        >>> cache = Cache()
+        >>> cache["test_key"] = "test_value"
+        >>> cache.clear()
+        >>> assert not cache
+        """
+
+        self._tree = Quadtree()
+        self._expiry_priority_nodes.clear()
+        self._key_nodes.clear()
+        self._expiry_heap.clear()
+
+    def __contains__(self, key: object) -> bool:
+        """Indicates whether a valid entry exists for a key.
+
+        Unlike retrieving the value of the entry, this does not reset the
+        entry's timestamp used for determining LRU.
+        """
+
+        node = self._key_nodes.get(key)
+        return node is not None and node.expiry >= self.clock()
 
     def __delitem__(self, key: KT):
         """Deletes an entry from the cache, identified by its key"""
 
         node = self._key_nodes.pop(key)
         node.delete_entry(key)
+        self._forget_removed(node)
 
     def __getitem__(self, key: KT) -> VT:
         """Retrieves the value of an entry from the cache.
@@ -174,13 +356,12 @@ class Cache(MutableMapping[KT, VT]):
         determining LRU according to the current time reported by the clock.
         """
 
-        try:
-            node = self._key_nodes[key]
-        except KeyError:
-            raise KeyDoesNotExist
+        node = self._key_nodes.get(key)
+        if node is None:
+            raise KeyDoesNotExist(key)
         now = self.clock()
-        if node.expired(now):
-            raise KeyExpired
+        if node.expiry < now:
+            raise KeyExpired(key)
 
         value = node.access_entry(key, now)
         return value
@@ -197,22 +378,14 @@ class Cache(MutableMapping[KT, VT]):
         >>> assert len(cache) == 2
         """
 
-        return len(
-            [
-                key
-                for key, node in self._key_nodes.items()
-                if not node.expired(self.clock()) and key in node._data
-            ]
-        )
+        now = self.clock()
+        return sum(1 for node in self._key_nodes.values() if node.expiry >= now)
 
     def __iter__(self) -> Iterator[KT]:
         """Allows for iteration of the keys of valid entries in the cache."""
 
-        return (
-            key
-            for key, node in self._key_nodes.items()
-            if not node.expired(self.clock()) and key in node._data
-        )
+        now = self.clock()
+        return (key for key, node in self._key_nodes.items() if node.expiry >= now)
 
     def __setitem__(self, key: KT, value: VT) -> None:
         """Set the value of a keyed entry.
@@ -222,27 +395,109 @@ class Cache(MutableMapping[KT, VT]):
 
         If an entry for a given key already exists, then it is deleted and a
         new entry with this key is added to the cache with new expiry and
-        priority values according to the current context.
+        priority values according to the current context. If the existing
+        entry already has those expiry and priority values, then it is
+        updated in place instead.
 
         Args:
             key: The key of the entry
             value: The value of the entry
         """
 
+        settings = self._context
+        if settings is None:
+            settings = self._resolve_settings(None, None)
+        priority, expiry_duration = settings
         now = self.clock()
-        expiry = now + self._context_expiry_duration
-        assert expiry > now
+        self._set_at(now, key, value, priority, now + expiry_duration)
+
+    def _resolve_settings(
+        self, priority: Optional[Priority], expiry_duration: Optional[Time]
+    ) -> Tuple[Priority, Time]:
+        """Replaces unset priority and expiry duration values with the
+        defaults.
 
-        priority = self._context_priority
+        Raises:
+            ValueError: expiry_duration, or default_expiry_duration if it is
+                used, is not positive.
+        """
 
-        if key in self._key_nodes:
-            del self[key]
+        if priority is None:
+            priority = self.default_priority
+        if expiry_duration is None:
+            expiry_duration = self.default_expiry_duration
+            if expiry_duration <= 0:
+                raise ValueError("default_expiry_duration must be positive")
+        elif expiry_duration <= 0:
+            raise ValueError("expiry_duration must be positive")
+        return priority, expiry_duration
+
+    def _compact_expiry_heap(self) -> None:
+        """Rebuilds the expiry heap from the points of the nodes in the point
+        map.
+
+        Points are left in the heap when their nodes are removed from the
+        quadtree before they expire. Rebuilding the heap once it holds more
+        than twice as many points as the point map keeps its size bounded for
+        callers that rarely evict, at an amortised O(1) cost per insert.
+        """
 
-        try:
-            node = self._expiry_priority_nodes[(expiry, priority)]
-        except KeyError:
+        self._expiry_heap = list(self._expiry_priority_nodes)
+        heapq.heapify(self._expiry_heap)
+
+    def _forget_removed(self, node: Node) -> None:
+        """Removes nodes that have been removed from the quadtree from the
+        point map.
+
+        Cleaning a node may also remove its empty ancestors, so the parents of
+        the given node are followed for as long as they have been removed.
+
+        Args:
+            node: A node that may have just been removed from the quadtree.
+        """
+
+        points = self._expiry_priority_nodes
+        while isinstance(node, Node) and node.removed:
+            point = (node.expiry, node.priority)
+            if points.get(point) is node:
+                del points[point]
+            node = node.parent
+
+    def _set_at(
+        self, now: Time, key: KT, value: VT, priority: Priority, expiry: Time
+    ) -> None:
+        """Set the value of a keyed entry with an explicit time, priority and
+        expiry.
+
+        See `__setitem__` for more information.
+
+        Args:
+            now: The current time.
+            key: The key of the entry
+            value: The value of the entry
+            priority: The priority of the entry.
+            expiry: The time at which the entry expires.
+        """
+
+        existing = self._key_nodes.get(key)
+        if existing is not None:
+            if existing.expiry == expiry and existing.priority == priority:
+                existing.update_entry(key, value, now)
+                return
+            # the old entry is removed before looking up the target node, as
+            #  cleaning its node may remove the target from the tree. The
+            #  key's own mapping is overwritten below.
+            existing.delete_entry(key)
+            self._forget_removed(existing)
+
+        expiry_priority = (expiry, priority)
+        node = self._expiry_priority_nodes.get(expiry_priority)
+        if node is None:
             node = self._tree.insert(priority, expiry)
+            self._expiry_priority_nodes[expiry_priority] = node
+            heapq.heappush(self._expiry_heap, expiry_priority)
+            if len(self._expiry_heap) > 2 * len(self._expiry_priority_nodes):
+                self._compact_expiry_heap()
 
         node.add_entry(key, value, now)
         self._key_nodes[key] = node
-        self._expiry_priority_nodes[(expiry, priority)] = node
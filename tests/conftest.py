@@ -0,0 +1,14 @@
+"""Configuration for Priority Expiry Cache tests.
+
+Hypothesis profiles are selected with the `HYP_PROFILE` environment variable.
+The `ci` profile is used by default, and the `nightly` profile runs many more
+examples per test.
+"""
+
+import os
+
+from hypothesis import settings
+
+settings.register_profile("ci", max_examples=25)
+settings.register_profile("nightly", max_examples=1000)
+settings.load_profile(os.environ.get("HYP_PROFILE", "ci"))
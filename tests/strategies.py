@@ -1,13 +1,14 @@
 """Strategies, test objects and helpers for Priority Expiry Cache tests."""
 
 from dataclasses import dataclass, field
-from typing import Hashable, Any, List
+from typing import Hashable, Any, List, Tuple
+import pytest
 from hypothesis import strategies as st
 
 from priority_expiry import Cache
 
 
-@dataclass(eq=True, order=True)
+@dataclass(eq=True, order=True, slots=True)
 class Entry:
     """A representation of an entry that is to be inserted into the cache."""
 
@@ -62,13 +63,38 @@ def entries_lists(**kwargs):
     )
 
 
+def items(entries: List[Entry]) -> List[Tuple[Hashable, Any]]:
+    """Helper function to get the key-value pairs of many entries.
+
+    Tests that check many entries against a cache can loop over these pairs
+    rather than looking up the attributes of each entry on every pass.
+    """
+
+    return [(entry.key, entry.value) for entry in entries]
+
+
 def set_entries(cache: Cache, entries: List[Entry]) -> None:
     """Helper function to input many entries into a cache.
 
     Entries are input in sorted order to make it easy for tests to permutate
-    different entry orders.
+    different entry orders. All entries are set with a single bulk put, so the
+    clock is read once.
+    """
+
+    cache.bulk_put(
+        (entry.key, entry.value, entry.priority, entry.expiry_duration)
+        for entry in sorted(entries)
+    )
+
+
+def assert_missing(cache: Cache, key: Hashable) -> None:
+    """Helper function to assert that a key has no valid entry in a cache.
+
+    This is much cheaper than `pytest.raises` when checking many keys.
     """
 
-    for entry in sorted(entries):
-        with cache.context(entry.priority, entry.expiry_duration):
-            cache[entry.key] = entry.value
+    try:
+        cache[key]
+    except KeyError:
+        return
+    pytest.fail(f"{key!r} should not be in the cache")
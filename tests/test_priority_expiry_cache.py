@@ -1,11 +1,11 @@
 """Tests for Priority Expiry Cache."""
 
 import pytest
-from hypothesis import given, assume
+from hypothesis import given, assume, settings
 
 from priority_expiry import Cache
 from tests import strategies
-from tests.strategies import FakeClock, set_entries
+from tests.strategies import FakeClock, set_entries, assert_missing
 
 
 @given(entry=strategies.entries())
@@ -28,8 +28,8 @@ def test_set_and_get_multiple_values(entries):
 
     set_entries(cache, entries)
 
-    for entry in entries:
-        assert cache[entry.key] is entry.value
+    for key, value in strategies.items(entries):
+        assert cache[key] is value
 
 
 @given(entries=strategies.entries_lists())
@@ -38,12 +38,11 @@ def test_get_twice(entries):
     cache = Cache(clock=FakeClock())
 
     set_entries(cache, entries)
+    items = strategies.items(entries)
 
-    for entry in entries:
-        assert cache[entry.key] is entry.value
-
-    for entry in entries:
-        assert cache[entry.key] is entry.value
+    for _ in range(2):
+        for key, value in items:
+            assert cache[key] is value
 
 
 @given(entries=strategies.entries_lists())
@@ -52,12 +51,202 @@ def test_overwrite(entries):
     cache = Cache(clock=FakeClock())
 
     set_entries(cache, entries)
+    keys = [entry.key for entry in entries]
+
+    for key in keys:
+        cache[key] = 0
+
+    for key in keys:
+        assert cache[key] == 0
+
+
+@given(entries=strategies.entries_lists())
+def test_delete(entries):
+    """Confirm that entries can be deleted from the cache."""
+    cache = Cache(clock=FakeClock())
+
+    set_entries(cache, entries)
+    deleted, kept = entries[::2], entries[1::2]
+    for entry in deleted:
+        del cache[entry.key]
+
+    for entry in deleted:
+        assert_missing(cache, entry.key)
+        with pytest.raises(KeyError):
+            del cache[entry.key]
+    for key, value in strategies.items(kept):
+        assert cache[key] is value
+    assert len(cache) == len(kept)
 
+
+@given(entries=strategies.entries_lists(min_expiry=1, n_expiry=20))
+def test_clear(entries):
+    """Confirm that all entries, including expired ones, are removed when the
+    cache is cleared and that the cache can be used again afterwards."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    set_entries(cache, entries)
+    clock.advance(10)
+    cache.clear()
+
+    assert len(cache) == 0
     for entry in entries:
-        cache[entry.key] = 0
+        with pytest.raises(KeyError):
+            del cache[entry.key]
+    cache.evict()
+
+    set_entries(cache, entries)
+    for key, value in strategies.items(entries):
+        assert cache[key] is value
+
+
+@given(entries=strategies.entries_lists())
+def test_overwrite_and_delete_release_nodes(entries):
+    """Confirm that nodes emptied by overwriting and deleting entries are
+    released without needing to evict."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    for _ in range(10):
+        set_entries(cache, entries)
+        clock.advance(1)
+    # empty nodes are only kept while they divide at least two quadrants, so
+    #  there are fewer of them than there are nodes with entries. The expiry
+    #  heap is rebuilt before it holds twice as many points as the point map.
+    assert len(cache._expiry_priority_nodes) < 2 * max(len(entries), 1)
+    assert len(cache._expiry_heap) < 4 * max(len(entries), 1)
+
+    for entry in entries:
+        del cache[entry.key]
+    assert not cache._expiry_priority_nodes
+
+
+@given(entries=strategies.entries_lists())
+def test_overwrite_same_context(entries):
+    """Confirm that entries can be overwritten with new values using the same
+    priority and expiry as the original entries."""
+    cache = Cache(clock=FakeClock())
+
+    set_entries(cache, entries)
+    for entry in sorted(entries):
+        with cache.context(entry.priority, entry.expiry_duration):
+            cache[entry.key] = -entry.value
+
+    for key, value in strategies.items(entries):
+        assert cache[key] == -value
+    assert len(cache) == len(entries)
+
+
+@given(entries=strategies.entries_lists())
+def test_put(entries):
+    """Confirm that entries set with an explicit priority and expiry duration
+    are given those values."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    with cache.context(priority=0, expiry_duration=1000):
+        for entry in entries:
+            cache.put(entry.key, entry.value, entry.priority, entry.expiry_duration)
+    clock.advance(10)
 
     for entry in entries:
-        assert cache[entry.key] == 0
+        if entry.expiry_duration < 10:
+            assert_missing(cache, entry.key)
+    valid = [entry for entry in entries if entry.expiry_duration >= 10]
+    for key, value in strategies.items(valid):
+        assert cache[key] is value
+
+
+@given(entries=strategies.entries_lists())
+def test_bulk_set(entries):
+    """Confirm that entries set together are all given the priority and
+    expiry duration of the bulk set."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    cache.bulk_set(strategies.items(entries), priority=0, expiry_duration=10)
+    clock.advance(10)
+    for key, value in strategies.items(entries):
+        assert cache[key] is value
+
+    clock.advance(1)
+    assert len(cache) == 0
+
+
+def test_nested_context():
+    """Confirm that the outer context applies again when a nested context
+    exits."""
+    clock = FakeClock()
+    cache = Cache(clock=clock, default_expiry_duration=100)
+
+    with cache.context(expiry_duration=1):
+        with cache.context(expiry_duration=10):
+            cache["inner"] = 0
+        cache["outer"] = 0
+    cache["default"] = 0
+    clock.advance(2)
+    cache.evict()
+
+    assert set(cache) == {"inner", "default"}
+
+
+def test_context_decorator():
+    """Confirm that a context can be used as a function decorator and that it
+    uses the cache's defaults at the time it is entered."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    @cache.context(expiry_duration=10)
+    def set_entry(key):
+        cache[key] = 0
+
+    cache.default_priority = 1
+    set_entry("low")
+    cache.default_priority = 0
+    set_entry("high")
+    cache.evict()
+    assert set(cache) == {"high"}
+
+    clock.advance(11)
+    cache["default"] = 0
+    cache.evict()
+    assert set(cache) == {"default"}
+
+
+def test_default_changed_after_context():
+    """Confirm that entries set outside of a context use the defaults at the
+    time they are set, including after a context has exited."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    cache.default_priority = 5
+    with cache.context(priority=1):
+        cache["high"] = 0
+    cache["low"] = 0
+    cache.evict()
+    assert set(cache) == {"high"}
+
+    cache.default_expiry_duration = 1
+    cache["short"] = 0
+    clock.advance(2)
+    assert "short" not in cache
+
+
+def test_context_non_positive_expiry_duration():
+    """Confirm that entries cannot be given a non-positive expiry duration."""
+    cache = Cache(clock=FakeClock())
+
+    with pytest.raises(ValueError):
+        with cache.context(expiry_duration=0):
+            pass
+
+    cache.default_expiry_duration = -5
+    with pytest.raises(ValueError):
+        cache["key"] = 0
+    with pytest.raises(ValueError):
+        with cache.context(priority=1):
+            pass
 
 
 @given(entries=strategies.entries_lists(min_expiry=1, n_expiry=20))
@@ -76,12 +265,50 @@ def test_evict_expired(entries):
 
     for entry in entries:
         if start_time + entry.expiry_duration < next_time:
-            with pytest.raises(KeyError):
-                _ = cache[entry.key]
-        else:
-            assert cache[entry.key] is entry.value
+            assert entry.key not in cache
+    valid = [
+        entry for entry in entries if start_time + entry.expiry_duration >= next_time
+    ]
+    for key, value in strategies.items(valid):
+        assert key in cache
+        assert cache[key] is value
+
+
+def test_contains_does_not_access():
+    """Confirm that checking whether an entry exists does not count as using
+    it when determining the least recently used entry."""
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+
+    cache["first"] = 0
+    clock.advance(1)
+    cache["second"] = 0
+    clock.advance(1)
+    assert "first" in cache
+    cache.evict()
+
+    assert set(cache) == {"second"}
+
+
+@given(entries=strategies.entries_lists(min_expiry=1, n_expiry=20))
+def test_set_after_evict_expired(entries):
+    """Confirm that entries can be set again after they have been evicted for
+    expiring."""
+
+    clock = FakeClock()
+    cache = Cache(clock=clock)
+    set_entries(cache, entries)
+    clock.advance(10)
+    cache.evict()
+
+    set_entries(cache, entries)
 
+    for key, value in strategies.items(entries):
+        assert cache[key] is value
+    assert len(cache) == len(entries)
 
+
+@settings(deadline=None)
 @given(
     entries=strategies.entries_lists(
         min_priority=0, n_priority=5, min_key=0, n_key=10000
@@ -92,20 +319,17 @@ def test_evict_lowest_priority(entries, lowest_priority_entry):
     """Confirm that the correct lowest priority entry is evicted when no
     entries have expired."""
 
-    entries.append(lowest_priority_entry)
     cache = Cache(clock=FakeClock())
-    set_entries(cache, entries)
+    set_entries(cache, entries + [lowest_priority_entry])
 
     cache.evict()
 
-    for entry in entries:
-        if entry is lowest_priority_entry:
-            with pytest.raises(KeyError):
-                _ = cache[entry.key]
-        else:
-            assert cache[entry.key] is entry.value
+    assert_missing(cache, lowest_priority_entry.key)
+    for key, value in strategies.items(entries):
+        assert cache[key] is value
 
 
+@settings(deadline=None)
 @given(
     entries=strategies.entries_lists(
         min_expiry=2, min_priority=0, n_priority=5, min_key=0, n_key=10000
@@ -137,14 +361,12 @@ def test_evict_lowest_priority_least_recently_used_set(
 
     cache.evict()
 
-    with pytest.raises(KeyError):
-        _ = cache[lru_lowest_priority_entry.key]
-    for entry in lowest_priority_entries:
-        assert cache[entry.key] is entry.value
-    for entry in entries:
-        assert cache[entry.key] is entry.value
+    assert_missing(cache, lru_lowest_priority_entry.key)
+    for key, value in strategies.items(lowest_priority_entries + entries):
+        assert cache[key] is value
 
 
+@settings(deadline=None)
 @given(
     entries=strategies.entries_lists(
         min_expiry=2, min_priority=0, n_priority=5, min_key=0, n_key=10000
@@ -177,14 +399,12 @@ def test_evict_lowest_priority_least_recently_used_get(
 
     cache.evict()
 
-    with pytest.raises(KeyError):
-        _ = cache[lru_lowest_priority_entry.key]
-    for entry in lowest_priority_entries:
-        assert cache[entry.key] is entry.value
-    for entry in entries:
-        assert cache[entry.key] is entry.value
+    assert_missing(cache, lru_lowest_priority_entry.key)
+    for key, value in strategies.items(lowest_priority_entries + entries):
+        assert cache[key] is value
 
 
+@settings(deadline=None)
 @given(
     expiring_entries=strategies.entries_lists(
         min_expiry=1,
@@ -264,17 +484,13 @@ def test_evict_expired_then_lowest_priority(
     cache.evict()  # evict expired
     cache.evict()  # evict lru lowest
 
-    with pytest.raises(KeyError):
-        _ = cache[surviving_lru_lowest_priority_entry.key]
-    with pytest.raises(KeyError):
-        _ = cache[expiring_lru_lowest_priority_entry.key]
+    assert_missing(cache, surviving_lru_lowest_priority_entry.key)
+    assert_missing(cache, expiring_lru_lowest_priority_entry.key)
     for entry in expiring_entries:
-        with pytest.raises(KeyError):
-            _ = cache[entry.key]
+        assert_missing(cache, entry.key)
     for entry in expiring_low_priority_entries:
-        with pytest.raises(KeyError):
-            _ = cache[entry.key]
-    for entry in surviving_entries:
-        assert cache[entry.key] is entry.value
-    for entry in surviving_low_priority_entries:
-        assert cache[entry.key] is entry.value
+        assert_missing(cache, entry.key)
+    for key, value in strategies.items(
+        surviving_entries + surviving_low_priority_entries
+    ):
+        assert cache[key] is value